@@ -1,28 +1,64 @@
 from __future__ import annotations
-from typing import Optional, Iterable
+from typing import Optional, Iterable, Iterator
 
+import os
+import sys
 import json
+import queue
+import logging
+import multiprocessing
 import time
+import asyncio
 import random
+import itertools
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-from typing import Dict, List, Tuple
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from colorama import Fore, Style
 
+import aiohttp
 import requests
+import rlp
+from requests.adapters import HTTPAdapter
+from eth_account import Account
+from eth_utils import keccak
 from web3 import Web3
 from web3.providers.rpc import HTTPProvider
 
+try:
+    # libsecp256k1 绑定，签名比 eth_account 的纯 Python 路径快一个数量级；未安装时回退
+    import coincurve
+except ImportError:
+    coincurve = None
+
 # ========= 基本配置 =========
-RPC_URL = "https://mainnet.base.org"              # Base 主网 RPC
+RPC_URLS = [                                       # Base 主网 RPC，按 worker 轮询分配并做健康检查
+    "https://mainnet.base.org",
+    "https://base.llamarpc.com",
+    "https://base-rpc.publicnode.com",
+    "https://base.blockpi.network/v1/rpc/public",
+]
+RPC_URL = RPC_URLS[0]
+RPC_FAIL_THRESHOLD = 3                             # 窗口内失败(429/5xx/连接错误)超过该次数的节点暂时跳过
+RPC_FAIL_WINDOW = 60
 TOKEN_ADDRESS = "0x833589fcd6edb6e08f4c7c32d4f71b54bda02913"                 # 需要授权且作为 investment token 的 ERC20
 TOKEN_DECIMALS = 6                                 # 代币精度(如USDC/USDT=6, 大部分=18)
+_DECIMALS_MULT = 10 ** TOKEN_DECIMALS
 PRIVATE_KEYS_FILE = "private_keys.txt"
 PROXIES_FILE = "proxies.txt"                       # 代理列表(可选)
+APPROVED_FILE = "approved.ndjson"                  # 本地已授权记录（追加写），命中则跳过 allowance 查询和授权
 
 CHAIN_ID = 8453
 MAX_WORKERS = 24
+SIGN_PROCESS_THRESHOLD = 50                        # 钱包数超过该值时签名交给进程池（绕开 GIL；仅在没有 coincurve 时启用）
 REQ_TIMEOUT = 30
+HTTP_POOL_SIZE = 64                                # 每个代理共享 Session 的连接池大小
+RPC_MAX_RPS_PER_PROXY = 10                         # 每个代理对每个 RPC 节点的请求上限（遇 429 自动减半，之后缓慢恢复）
 
 # 授权相关
 DO_APPROVE = True
@@ -30,7 +66,7 @@ GAS_LIMIT_APPROVE = 120000
 USE_MAX_ALLOWANCE = True
 MAX_UINT256 = 2**256 - 1
 ALLOWANCE_THRESHOLD = MAX_UINT256 // 2
-CHECK_ALLOWANCE = True                             # 建议大量并发时关闭以防 429
+CHECK_ALLOWANCE = True                             # 建议大量并发时关闭以防 429（本地已授权记录的 market 不会再查）
 
 # buy 调用参数（全局默认，可在运行时输入覆盖）
 DO_BUY = True
@@ -41,36 +77,49 @@ BUY_MIN_OUTCOME_TOKENS = 0                          # 最小接收量（未知
 
 # 发送重试 & 限速
 SEND_RETRIES = 2
+RPC_BATCH_RETRIES = 3                              # batch 读请求遇 429/5xx/连接错误时的尝试次数（退避间隔同 RETRY_SLEEP）
 RETRY_SLEEP = 5
 SLEEP_BETWEEN_TX = 0.8                          # 同一钱包内每笔之间间隔+抖动
+GAS_PRICE_TTL = 5                                  # gasPrice 缓存秒数（Base 上变化慢）
+RECEIPT_TIMEOUT = 30                               # 钱包结束时统一等待回执的最长秒数
+RECEIPT_POLL = 3                                   # 回执批量轮询间隔
+RECEIPT_CHECK_EVERY = 5                            # 发送阶段每发出 K 笔交易顺带非阻塞查一次已发交易回执
 # ===========================
 
-# ====== 最小 ABI ======
-ERC20_ABI = [
-    {"constant": False, "inputs":[{"name":"_spender","type":"address"},{"name":"_value","type":"uint256"}],
-     "name":"approve","outputs":[{"name":"success","type":"bool"}],"type":"function"},
-    {"constant": True, "inputs":[{"name":"_owner","type":"address"},{"name":"_spender","type":"address"}],
-     "name":"allowance","outputs":[{"name":"remaining","type":"uint256"}],"type":"function"},
-{
-    "constant": True,
-    "inputs": [{"name": "_owner", "type": "address"}],
-    "name": "balanceOf",
-    "outputs": [{"name": "balance", "type": "uint256"}],
-    "type": "function"
-}
-]
-
-# 只包含 buy 方法即可编码 data 和发交易
-MARKET_ABI = [
-    {"inputs":[
-        {"internalType":"uint256","name":"investmentAmount","type":"uint256"},
-        {"internalType":"uint256","name":"outcomeIndex","type":"uint256"},
-        {"internalType":"uint256","name":"minOutcomeTokensToBuy","type":"uint256"}],
-     "name":"buy","outputs":[], "stateMutability":"nonpayable","type":"function"}
-]
+# 4 字节函数选择器（写死，calldata 手工按 32 字节槽拼接，不走 Contract/ABI 编码）
+BALANCE_OF_SELECTOR = bytes.fromhex("70a08231")    # keccak("balanceOf(address)")[:4]
+ALLOWANCE_SELECTOR = bytes.fromhex("dd62ed3e")     # keccak("allowance(address,address)")[:4]
+APPROVE_SELECTOR = bytes.fromhex("095ea7b3")       # keccak("approve(address,uint256)")[:4]
+BUY_SELECTOR = bytes.fromhex("40993b26")           # keccak("buy(uint256,uint256,uint256)")[:4]
 
 ALL_MARKET = {}
 
+# 本地已授权记录：(token 小写, owner) -> {spender}，由 APPROVED_FILE 加载，多线程追加时加锁；
+# key 带上 token，同一进程内对不同 token 多次 run_for_markets 也不会串用授权记录
+APPROVED: Dict[Tuple[str, str], Set[str]] = {}
+_APPROVED_LOCK = threading.Lock()
+
+# 工作线程的日志：默认直接写 stdout；并发执行期间经 QueueHandler 交给单独的 I/O 线程输出，
+# 避免 24 个线程在 print 的 stdout 锁上互相等待
+logger = logging.getLogger("limitless")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_STDOUT_HANDLER = logging.StreamHandler(sys.stdout)
+_STDOUT_HANDLER.setFormatter(logging.Formatter("%(message)s"))
+logger.addHandler(_STDOUT_HANDLER)
+
+# 大批量钱包时用于并行签名的进程池（None 表示在当前线程内签名）
+_SIGN_POOL: Optional[ProcessPoolExecutor] = None
+
+# 每个代理（None=直连）共享一个 keep-alive Session
+_SESSIONS: Dict[str, requests.Session] = {}
+_SESSIONS_LOCK = threading.Lock()
+
+# RPC 节点健康记录：url -> 最近失败时间戳；_RPC_RR 用于轮询
+_RPC_FAILURES: Dict[str, List[float]] = {}
+_RPC_LOCK = threading.Lock()
+_RPC_RR = itertools.count()
+
 # ====== 工具函数 ======
 def load_json_map(path: str) -> Dict[str, int]:
     p = Path(path)
@@ -106,20 +155,73 @@ def load_proxies(path: str) -> List[str]:
                 proxies.append(u)
     return proxies
 
-def fetch_markets_for_oracle(oracle_id: int) -> List[str]:
+def load_approved(path: str, token_addr: str) -> Dict[Tuple[str, str], Set[str]]:
+    p = Path(path)
+    approved: Dict[Tuple[str, str], Set[str]] = {}
+    if not p.exists():
+        return approved
+    token = token_addr.lower()
+    with p.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue                           # 写入中断留下的半行，忽略
+            if not isinstance(rec, dict) or not all(isinstance(rec.get(k), str) for k in ("owner", "spender", "token")):
+                continue                           # 格式不对的记录，忽略
+            if rec["token"].lower() != token:
+                continue
+            spenders = approved.setdefault((token, rec["owner"]), set())
+            if rec.get("revoked"):
+                spenders.discard(rec["spender"])   # 后写的撤销记录覆盖之前的授权记录
+            else:
+                spenders.add(rec["spender"])
+    return approved
+
+def record_approved(owner: str, spender: str, token_addr: str, path: str = APPROVED_FILE):
+    """记录 owner 已对 spender 授权足额：更新内存中的 APPROVED 并追加一行到 NDJSON 文件"""
+    line = json.dumps({"owner": owner, "spender": spender, "token": token_addr}) + "\n"
+    with _APPROVED_LOCK:
+        spenders = APPROVED.setdefault((token_addr.lower(), owner), set())
+        if spender in spenders:
+            return
+        spenders.add(spender)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+def revoke_approved(owner: str, spender: str, token_addr: str, path: str = APPROVED_FILE):
+    """撤销本地授权记录（如 buy 链上失败，授权可能已失效）：从 APPROVED 移除并追加一行 revoked 记录"""
+    line = json.dumps({"owner": owner, "spender": spender, "token": token_addr, "revoked": True}) + "\n"
+    with _APPROVED_LOCK:
+        spenders = APPROVED.get((token_addr.lower(), owner))
+        if not spenders or spender not in spenders:
+            return
+        spenders.discard(spender)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+async def fetch_markets_for_oracle(session: aiohttp.ClientSession, oracle_id: int) -> Optional[str]:
     url = f"https://api.limitless.exchange/markets/prophet?priceOracleId={oracle_id}&frequency=hourly"
     for attempt in range(1, 4):
         try:
-            r = requests.get(url,timeout=3)
-            r.raise_for_status()
-            data = r.json()
-            ALL_MARKET[oracle_id] = data['market']['address']
-            break
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=3)) as r:
+                r.raise_for_status()
+                data = await r.json()
+            return data['market']['address']
         except Exception as e:
             if attempt < 3:
-                time.sleep(1.0 * attempt)
+                await asyncio.sleep(1.0 * attempt)
             else:
                 print(f"⚠️ 获取 markets 失败 id={oracle_id}: {e}")
+    return None
+
+async def fetch_all(items: List[Tuple[str, int]]) -> list:
+    """
+    一个事件循环 + 一个 keep-alive ClientSession 并发拉取所有 oracle 的市场地址，
+    返回值与 items 一一对应（失败为 None 或异常对象），由调用方汇总。
+    """
+    async with aiohttp.ClientSession() as s:
+        return await asyncio.gather(*(fetch_markets_for_oracle(s, oid) for _, oid in items), return_exceptions=True)
 
 def ensure_checksum_list(w3: Web3, addresses: List[str]) -> List[str]:
     res = []
@@ -130,156 +232,573 @@ def ensure_checksum_list(w3: Web3, addresses: List[str]) -> List[str]:
             print(f"  ⚠️ 非法地址跳过: {a}")
     return list(dict.fromkeys(res))
 
-def make_w3_with_proxy(proxy_url: str | None) -> Web3:
+class RateLimiter:
+    """
+    令牌桶限速（线程安全）：每秒补充 rps 个令牌，取不到时睡到下一个令牌。
+    遇到 429 时 rps 减半，之后每次正常响应缓慢加回 max_rps（AIMD）。
+    """
+    def __init__(self, max_rps: float):
+        self.max_rps = max_rps
+        self.rps = max_rps
+        self.tokens = max_rps
+        self.ts = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, n: int = 1):
+        """取 n 个令牌；n 超过桶容量时等桶满后照扣（令牌记为负数），之后的请求相应多等"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rps, self.tokens + (now - self.ts) * self.rps)
+                self.ts = now
+                need = min(n, self.rps)
+                if self.tokens >= need:
+                    self.tokens -= n
+                    return
+                wait = (need - self.tokens) / self.rps
+            time.sleep(wait)
+
+    def backoff(self):
+        with self.lock:
+            self.rps = max(1.0, self.rps / 2)
+
+    def recover(self):
+        with self.lock:
+            self.rps = min(self.max_rps, self.rps + 0.1)
+
+def _recent_failures(url: str, now: float) -> int:
+    return sum(1 for t in _RPC_FAILURES.get(url, ()) if now - t < RPC_FAIL_WINDOW)
+
+def mark_rpc_failure(url: str):
+    now = time.time()
+    with _RPC_LOCK:
+        _RPC_FAILURES[url] = [t for t in _RPC_FAILURES.get(url, ()) if now - t < RPC_FAIL_WINDOW] + [now]
+
+def is_rpc_healthy(url: str) -> bool:
+    with _RPC_LOCK:
+        return _recent_failures(url, time.time()) <= RPC_FAIL_THRESHOLD
+
+def pick_rpc_url(exclude: str | None = None) -> str:
+    """
+    在 RPC_URLS 中轮询挑一个健康节点（最近 RPC_FAIL_WINDOW 秒内失败不超过 RPC_FAIL_THRESHOLD 次）；
+    全部不健康时退回失败次数最少的那个。exclude 为刚失败的节点，有别的节点可选时不会再选它。
+    """
+    candidates = [u for u in RPC_URLS if u != exclude] or RPC_URLS
+    now = time.time()
+    with _RPC_LOCK:
+        failures = {u: _recent_failures(u, now) for u in candidates}
+    healthy = [u for u in candidates if failures[u] <= RPC_FAIL_THRESHOLD]
+    if not healthy:
+        return min(candidates, key=failures.get)
+    return healthy[next(_RPC_RR) % len(healthy)]
+
+class RateLimitedSession(requests.Session):
+    """
+    经过该 Session 的每个 HTTP 请求（web3 调用、batch 请求）都先从对应节点的限速器取令牌：
+    单个调用取 1 个，JSON-RPC batch 按其中的调用数取（节点按调用数而不是 HTTP 请求数限流）；
+    429/5xx/连接错误同时记入节点健康记录。
+    """
+    def __init__(self, max_rps: float):
+        super().__init__()
+        self.max_rps = max_rps
+        self.limiters: Dict[str, RateLimiter] = {}
+        self.limiters_lock = threading.Lock()
+
+    def _limiter(self, url: str) -> RateLimiter:
+        with self.limiters_lock:
+            limiter = self.limiters.get(url)
+            if limiter is None:
+                limiter = self.limiters[url] = RateLimiter(self.max_rps)
+            return limiter
+
+    def request(self, method, url, *args, **kwargs):
+        limiter = self._limiter(url)
+        body = kwargs.get("json")
+        limiter.acquire(len(body) if isinstance(body, list) and body else 1)
+        try:
+            resp = super().request(method, url, *args, **kwargs)
+        except requests.RequestException:
+            mark_rpc_failure(url)
+            raise
+        if resp.status_code == 429:
+            limiter.backoff()
+        else:
+            limiter.recover()
+        if resp.status_code == 429 or resp.status_code >= 500:
+            mark_rpc_failure(url)
+        return resp
+
+def get_session(proxy_url: str | None) -> requests.Session:
+    """
+    同一代理的所有 worker 复用一个带大连接池、带限速的 Session：
+    减少 TCP/TLS 握手，并把该代理出口的 RPC 请求速率压在 RPC_MAX_RPS_PER_PROXY 以内。
+    """
+    key = proxy_url or "DIRECT"
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            session = RateLimitedSession(RPC_MAX_RPS_PER_PROXY)
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            if proxy_url:
+                session.proxies.update({"http": proxy_url, "https": proxy_url})
+            _SESSIONS[key] = session
+        return session
+
+def make_w3_with_proxy(proxy_url: str | None, rpc_url: str | None = None) -> Web3:
+    """rpc_url 为空时从 RPC_URLS 中轮询挑一个健康节点"""
     if proxy_url:
-        provider = HTTPProvider(RPC_URL, request_kwargs={"proxies":{"http":proxy_url,"https":proxy_url}, "timeout":REQ_TIMEOUT})
+        request_kwargs = {"proxies":{"http":proxy_url,"https":proxy_url}, "timeout":REQ_TIMEOUT}
     else:
-        provider = HTTPProvider(RPC_URL, request_kwargs={"timeout":REQ_TIMEOUT})
-    w3 = Web3(provider)
-    if not w3.is_connected():
-        raise RuntimeError(f"❌ 无法连接 RPC（proxy={proxy_url or 'DIRECT'}）")
-    return w3
+        request_kwargs = {"timeout":REQ_TIMEOUT}
+    provider = HTTPProvider(rpc_url or pick_rpc_url(), request_kwargs=request_kwargs, session=get_session(proxy_url))
+    # 不在这里探活：第一次真实调用出错时由调用方/重试逻辑处理
+    return Web3(provider)
+
+def to_smallest_unit(amount_human: float, decimals: int = TOKEN_DECIMALS) -> int:
+    # 经 str 转 Decimal 做整数运算，避免 2.01 * 10**6 = 2009999.99… 这类浮点截断
+    mult = _DECIMALS_MULT if decimals == TOKEN_DECIMALS else 10 ** decimals
+    return int(Decimal(str(amount_human)) * mult)
+
+def _word_address(addr: str) -> bytes:
+    """address 参数：左补 12 个 0 字节到 32 字节"""
+    return bytes(12) + bytes.fromhex(addr[2:])
+
+def _word_uint(value: int) -> bytes:
+    return value.to_bytes(32, "big")
+
+@lru_cache(maxsize=None)
+def encode_approve_data(spender: str, amount: int) -> str:
+    """approve(spender, amount) 的 calldata；只依赖 spender，所有钱包线程共享同一份结果"""
+    return "0x" + (APPROVE_SELECTOR + _word_address(spender) + _word_uint(amount)).hex()
+
+@lru_cache(maxsize=None)
+def encode_buy_data(investment: int, outcome_index: int, min_outcome_tokens: int) -> str:
+    """buy(...) 的 calldata；同一次运行内所有钱包、所有 market 参数相同，只编码一次"""
+    return "0x" + (BUY_SELECTOR + _word_uint(investment) + _word_uint(outcome_index)
+                   + _word_uint(min_outcome_tokens)).hex()
+
+def allowance_enough(allowance: int) -> bool:
+    return int(allowance) >= ALLOWANCE_THRESHOLD
+
+def _hex_to_int(value: Optional[str]) -> int:
+    if not value or value == "0x":
+        return 0
+    return int(value, 16)
+
+def rpc_batch(calls: List[Tuple[str, list]], proxy_url: str | None, rpc_url: str = RPC_URL,
+              retries: int = RPC_BATCH_RETRIES) -> List[dict]:
+    """
+    把多个 (method, params) 合并成一次 JSON-RPC batch POST，按请求顺序返回与 calls 等长的响应列表。
+    响应按 id 对回请求；缺失或 id 对不上的（如节点返回 "id": null 的错误对象）按该条请求失败处理。
+    整批失败（429/5xx/连接错误/整批被拒）时换下一个健康节点重试（没有别的节点时原地退避），最多 retries 次。
+    """
+    payload = [{"jsonrpc": "2.0", "id": i, "method": m, "params": p} for i, (m, p) in enumerate(calls)]
+    for attempt in range(1, retries + 1):
+        try:
+            r = get_session(proxy_url).post(rpc_url, json=payload, timeout=REQ_TIMEOUT)
+            r.raise_for_status()
+            resp = r.json()
+            if not isinstance(resp, list):
+                # 整批被拒（如限流 / 节点不支持 batch）时返回的是单个 error 对象
+                raise RuntimeError(f"batch 请求失败: {resp.get('error', resp) if isinstance(resp, dict) else resp}")
+            break
+        except Exception as e:
+            if attempt >= retries:
+                raise
+            next_url = pick_rpc_url(exclude=rpc_url)
+            sleep_s = (RETRY_SLEEP * attempt if next_url == rpc_url else 0) + random.random()
+            logger.warning("    ⚠️ batch 请求失败(%s/%s): %s，%.1fs 后经 %s 重试", attempt, retries, e, sleep_s, next_url)
+            rpc_url = next_url
+            time.sleep(sleep_s)
+    by_id = {x.get("id"): x for x in resp if isinstance(x, dict)}
+    return [by_id.get(i) or {"id": i, "error": "batch 响应中缺少该请求"} for i in range(len(calls))]
 
-def to_smallest_unit(amount_human: float, decimals: int) -> int:
-    return int(amount_human * (10 ** decimals))
+def fetch_balance_and_allowances(owner: str, token_cs: str, markets: List[str],
+                                 proxy_url: str | None, rpc_url: str = RPC_URL) -> Tuple[int, Dict[str, int]]:
+    """
+    一次 batch 请求拿到 balanceOf(owner) 和 owner 对每个 market 的 allowance。
+    返回 (balance, {market: allowance})；单个 allowance 查询失败按 0 处理（将直接发授权）。
+    """
+    def eth_call(data: bytes) -> Tuple[str, list]:
+        return "eth_call", [{"to": token_cs, "data": "0x" + data.hex()}, "latest"]
+
+    owner_word = _word_address(owner)
+    calls = [eth_call(BALANCE_OF_SELECTOR + owner_word)]
+    if CHECK_ALLOWANCE:
+        calls += [eth_call(ALLOWANCE_SELECTOR + owner_word + _word_address(m)) for m in markets]
+    resp = rpc_batch(calls, proxy_url, rpc_url)
+
+    if "error" in resp[0]:
+        raise RuntimeError(f"balanceOf 查询失败: {resp[0]['error']}")
+    balance = _hex_to_int(resp[0].get("result"))
+
+    allowances = {}
+    for i, m in enumerate(markets, 1):
+        allowance = 0
+        if CHECK_ALLOWANCE:
+            if "error" in resp[i]:
+                logger.warning("    ⚠️ allowance 查询失败（将直接发授权）: %s", resp[i]['error'])
+            else:
+                allowance = _hex_to_int(resp[i].get("result"))
+        allowances[m] = allowance
+    return balance, allowances
 
-def allowance_enough(token_contract, owner: str, spender: str) -> bool:
+def get_gas_price_cached(w3: Web3, state: Dict[str, int]) -> int:
+    """
+    线程内 gasPrice 缓存：state 为 worker 局部的 {"ts": 0, "val": 0}，
+    超过 GAS_PRICE_TTL 秒（或 ts 被置 0）才重新请求 eth_gasPrice。
+    """
+    if time.time() - state["ts"] > GAS_PRICE_TTL:
+        state["val"] = w3.eth.gas_price
+        state["ts"] = time.time()
+    return state["val"]
+
+_NONCE_ERR_HINTS = ("nonce too low", "nonce too high", "invalid nonce")
+_KNOWN_TX_HINTS = ("already known", "known transaction")
+
+def is_nonce_error(e: Exception) -> bool:
+    msg = str(e).lower()
+    return any(h in msg for h in _NONCE_ERR_HINTS)
+
+def _is_known_tx_error(e: Exception) -> bool:
+    msg = str(e).lower()
+    return any(h in msg for h in _KNOWN_TX_HINTS)
+
+@contextmanager
+def log_listener():
+    """并发执行期间把 logger 切到队列，由 QueueListener 线程统一写 stdout；退出时等队列写完再切回"""
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = QueueHandler(log_queue)
+    listener = QueueListener(log_queue, _STDOUT_HANDLER)
+    listener.start()
+    logger.removeHandler(_STDOUT_HANDLER)
+    logger.addHandler(queue_handler)
     try:
-        val = token_contract.functions.allowance(owner, spender).call()
-        return int(val) >= ALLOWANCE_THRESHOLD
-    except Exception as e:
-        print(f"    ⚠️ allowance 查询失败（将直接发授权）: {e}")
-        return False
+        yield
+    finally:
+        logger.removeHandler(queue_handler)
+        logger.addHandler(_STDOUT_HANDLER)
+        listener.stop()
 
-def send_raw_with_retry(w3: Web3, raw: bytes):
-    last_err = None
-    for attempt in range(1, SEND_RETRIES + 1):
+def _sign_raw(tx: dict, pk: str) -> bytes:
+    """
+    EIP-155 legacy 交易签名，返回 raw 交易。
+    有 coincurve 时手工 RLP 编码 + sign_recoverable，否则走 eth_account。
+    """
+    if coincurve is None:
+        return bytes(Account.sign_transaction(tx, pk).raw_transaction)
+    fields = [
+        tx["nonce"], tx["gasPrice"], tx["gas"],
+        bytes.fromhex(tx["to"][2:]), tx.get("value", 0), bytes.fromhex(tx["data"][2:]),
+    ]
+    chain_id = tx["chainId"]
+    msg_hash = keccak(rlp.encode(fields + [chain_id, 0, 0]))
+    sig = coincurve.PrivateKey(bytes.fromhex(pk[2:] if pk.startswith("0x") else pk)).sign_recoverable(msg_hash, hasher=None)
+    r = int.from_bytes(sig[:32], "big")
+    s = int.from_bytes(sig[32:64], "big")
+    v = sig[64] + 35 + 2 * chain_id
+    return rlp.encode(fields + [v, r, s])
+
+@contextmanager
+def sign_pool(wallet_count: int):
+    """
+    钱包数超过 SIGN_PROCESS_THRESHOLD 且没有 coincurve 时开启签名进程池：eth_account 的签名是
+    CPU 密集的，放在线程里会被 GIL 串行化；RPC I/O 仍由线程池负责。
+    coincurve 单次签名只需几十微秒，进程间通信反而更慢，此时直接在线程内签。
+    子进程用 spawn 启动：第一次 submit 时钱包线程和日志线程都在跑，fork 多线程进程可能死锁。
+    注意私钥会随每次 submit 序列化传给本机子进程。
+    """
+    global _SIGN_POOL
+    if coincurve is not None or wallet_count <= SIGN_PROCESS_THRESHOLD:
+        yield
+        return
+    _SIGN_POOL = ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, MAX_WORKERS),
+                                     mp_context=multiprocessing.get_context("spawn"))
+    try:
+        yield
+    finally:
+        pool, _SIGN_POOL = _SIGN_POOL, None
+        pool.shutdown()
+
+def iter_signed(txs: List[dict], pk: str) -> Iterator[bytes]:
+    """
+    按顺序逐个产出签好的 raw 交易。有进程池时一次性全部提交，
+    调用方发送第 k 笔的同时，后面的交易已在其它进程里签名；否则在当前线程按需签。
+    """
+    pool = _SIGN_POOL
+    if pool is None:
+        for tx in txs:
+            yield _sign_raw(tx, pk)
+        return
+    futs = [pool.submit(_sign_raw, tx, pk) for tx in txs]
+    try:
+        for f in futs:
+            yield f.result()
+    finally:
+        for f in futs:
+            f.cancel()                             # 调用方中途放弃（nonce 失效需重签）时撤掉未开始的
+
+def send_raw_with_retry(w3: Web3, raw: bytes, gas_state: Optional[Dict[str, int]] = None,
+                        proxy_url: str | None = None):
+    """
+    发送已签名交易；失败时把同一份 raw 换到下一个健康节点重发（没有别的节点时原地退避），
+    最多 max(SEND_RETRIES, len(RPC_URLS)) 次。之前的尝试其实已进入 mempool 时节点会回 already known，
+    按成功处理。
+    """
+    attempts = max(SEND_RETRIES, len(RPC_URLS))
+    for attempt in range(1, attempts + 1):
         try:
             return w3.eth.send_raw_transaction(raw)
         except Exception as e:
-            last_err = e
-            sleep_s = RETRY_SLEEP * attempt + random.random()
-            print(f"    ⚠️ 发送失败({attempt}/{SEND_RETRIES}): {e}，{sleep_s:.1f}s 后重试")
+            if is_nonce_error(e):
+                raise                              # 同一 raw 重发无意义，交给调用方刷新 nonce 重签
+            if _is_known_tx_error(e):
+                return Web3.keccak(raw)
+            if attempt >= attempts:
+                raise
+            if gas_state is not None:
+                gas_state["ts"] = 0                # 发送失败后强制刷新 gasPrice
+            next_url = pick_rpc_url(exclude=w3.provider.endpoint_uri)
+            sleep_s = (RETRY_SLEEP * attempt if next_url == w3.provider.endpoint_uri else 0) + random.random()
+            logger.warning("    ⚠️ 发送失败(%s/%s): %s，%.1fs 后经 %s 重发", attempt, attempts, e, sleep_s, next_url)
+            w3 = make_w3_with_proxy(proxy_url, next_url)
             time.sleep(sleep_s)
-    raise last_err
 
-def _prepare_oracle_map_from_markets(market_addresses: Iterable[str]) -> Dict[int, List[str]]:
+def wait_receipts_batch(tx_hashes: List[str], proxy_url: str | None, rpc_url: str = RPC_URL,
+                        timeout: float = RECEIPT_TIMEOUT, poll: float = RECEIPT_POLL) -> Dict[str, Optional[dict]]:
+    """
+    用 eth_getTransactionReceipt 的 batch 请求统一轮询一组交易，
+    返回 {tx_hash: receipt 或 None（超时仍未上链）}。
+    """
+    receipts: Dict[str, Optional[dict]] = {h: None for h in tx_hashes}
+    deadline = time.time() + timeout
+    while True:
+        pending = [h for h, r in receipts.items() if r is None]
+        if not pending:
+            break
+        try:
+            # 这里自带轮询，失败留到下一轮即可，不在 rpc_batch 内退避（reconcile(0) 不应阻塞发送）
+            resp = rpc_batch([("eth_getTransactionReceipt", [h]) for h in pending], proxy_url, rpc_url, retries=1)
+            for h, item in zip(pending, resp):
+                if item.get("result"):
+                    receipts[h] = item["result"]
+        except Exception as e:
+            logger.warning("    ⚠️ 批量查询回执失败: %s", e)
+        if time.time() >= deadline or all(r is not None for r in receipts.values()):
+            break
+        time.sleep(poll)
+    return receipts
+
+def _prepare_oracle_map_from_markets(market_addresses: Iterable[str]) -> Dict[int, Tuple[str, ...]]:
     """
     把 market 地址列表包装成 wallet_worker 可接收的 spenders_by_oracle 结构：
-    使用 key 0 (占位)，value 为传入的地址列表（已去重）。
+    使用 key 0 (占位)，value 为传入地址的 tuple（已转 checksum、按首次出现顺序去重）。
     """
-    uniq = []
-    for a in market_addresses:
-        if not a:
-            continue
-        if a not in uniq:
-            uniq.append(a)
-    return {0: uniq}
+    return {0: tuple(dict.fromkeys(Web3.to_checksum_address(a) for a in market_addresses if a))}
 
 # ====== 钱包线程 ======
-def wallet_worker(pk: str, spenders_by_oracle: Dict[int, List[str]], token_addr: str,
+def wallet_worker(pk: str, spenders_by_oracle: Dict[int, Tuple[str, ...]], token_addr: str,
                   buy_amount_smallest: int, buy_outcome_index: int, buy_min_tokens: int,
                   proxy_url: str | None) -> Tuple[str, int, int, int]:
     """
+    spenders_by_oracle 中的 market 地址须已是 checksum 格式（由 main / run_for_markets 统一转换）。
     返回: (wallet_addr, sent_approves, sent_buys, skipped_approves)
     """
     w3 = make_w3_with_proxy(proxy_url)
     acct = w3.eth.account.from_key(pk)
     addr = acct.address
-    token = w3.eth.contract(address=w3.to_checksum_address(token_addr), abi=ERC20_ABI)
+    token_cs = w3.to_checksum_address(token_addr)
+
+    def failover():
+        """当前节点被标记为不健康时换一个（已签名的交易发到哪个节点都一样）"""
+        nonlocal w3
+        if not is_rpc_healthy(w3.provider.endpoint_uri):
+            w3 = make_w3_with_proxy(proxy_url)
+            logger.warning("[%s] ⚠️ RPC 切换到 %s", addr[:6], w3.provider.endpoint_uri)
+
+    def read_with_failover(fn):
+        """fn(w3) 失败时换下一个健康节点再试，RPC_URLS 都试过仍失败才抛出"""
+        nonlocal w3
+        for i in range(len(RPC_URLS)):
+            try:
+                return fn(w3)
+            except Exception as e:
+                if i == len(RPC_URLS) - 1:
+                    raise
+                w3 = make_w3_with_proxy(proxy_url, pick_rpc_url(exclude=w3.provider.endpoint_uri))
+                logger.warning("[%s] ⚠️ 读取失败：%s，RPC 切换到 %s", addr[:6], e, w3.provider.endpoint_uri)
 
     try:
-        nonce = w3.eth.get_transaction_count(addr, block_identifier="pending")
+        next_nonce = read_with_failover(lambda w: w.eth.get_transaction_count(addr, block_identifier="pending"))
     except Exception as e:
-        print(f"[{addr[:6]}] ❌ 获取 nonce 失败（proxy={proxy_url or 'DIRECT'}）：{e}")
+        logger.error("[%s] ❌ 获取 nonce 失败（proxy=%s）：%s", addr[:6], proxy_url or 'DIRECT', e)
         return addr, 0, 0, 0
 
-    print(f"[{addr[:6]}] 开始（proxy={proxy_url or 'DIRECT'}），初始 nonce={nonce}")
+    logger.info("[%s] 开始（proxy=%s），初始 nonce=%s", addr[:6], proxy_url or 'DIRECT', next_nonce)
+
+    # 余额 / allowance 一次 batch 查完，循环内不再逐个 eth_call；
+    # 余额只会因本钱包的 buy 减少，之后在本地扣减即可；本地已记录授权的 market 不再查 allowance
+    all_markets = tuple(m for spenders in spenders_by_oracle.values() for m in spenders)
+    approved = APPROVED.get((token_cs.lower(), addr), set())
+    probe_markets = [m for m in all_markets if m not in approved]
+    try:
+        token_balance, allowances = read_with_failover(lambda w: fetch_balance_and_allowances(
+            addr, token_cs, probe_markets, proxy_url, w.provider.endpoint_uri))
+    except Exception as e:
+        logger.error("[%s] ❌ 查询余额/授权失败（proxy=%s）：%s", addr[:6], proxy_url or 'DIRECT', e)
+        return addr, 0, 0, 0
 
     sent_approve = 0
     sent_buy = 0
     skipped_approve = 0
-
-    # 遍历每个 oracle 的每个 market 地址
-    for oracle_id, spenders in spenders_by_oracle.items():
-        for market_addr in spenders:
-            market_cs = w3.to_checksum_address(market_addr)
-            token_balance = token.functions.balanceOf(addr).call()
-            human_balance = token_balance / (10 ** TOKEN_DECIMALS)
-            human_need = buy_amount_smallest / (10 ** TOKEN_DECIMALS)
-
-            if token_balance < buy_amount_smallest:
-                print(f"[{addr[:6]}] ⚠️ 余额不足，当前余额 {int(human_balance)}，购买需要 {int(human_need)}")
-                continue
-
-            # 1) 授权
-            if DO_APPROVE:
-                if CHECK_ALLOWANCE and allowance_enough(token, addr, market_cs):
-                    print(f"[{addr[:6]}] 跳过授权（已足够）→ {market_cs}")
-                    skipped_approve += 1
+    gas_state = {"ts": 0, "val": 0}
+    pending_txs: List[Tuple[str, str, int, str]] = []    # (tx_hash, kind, nonce, market)，尚未拿到回执
+
+    def reconcile(timeout: float):
+        """
+        批量查 pending_txs 的回执：成功的 approve 记入本地授权记录，
+        链上失败的从计数里扣除（发送时已乐观计数），失败的 buy 同时撤销该 market 的本地授权记录，
+        未出回执的留待下次。
+        """
+        nonlocal sent_approve, sent_buy, pending_txs
+        failover()
+        receipts = wait_receipts_batch([h for h, _, _, _ in pending_txs], proxy_url,
+                                       w3.provider.endpoint_uri, timeout=timeout)
+        still_pending = []
+        for tx_hash, kind, nonce, market_cs in pending_txs:
+            receipt = receipts.get(tx_hash)
+            if receipt is None:
+                still_pending.append((tx_hash, kind, nonce, market_cs))
+            elif _hex_to_int(receipt.get("status")) != 1:
+                logger.error("[%s] ❌ %s failed (status=0, nonce=%s): https://basescan.org/tx/%s", addr[:6], kind, nonce, tx_hash)
+                if kind == "APPROVE":
+                    sent_approve -= 1
                 else:
-                    try:
-                        gas_price = w3.eth.gas_price
-                        amount = MAX_UINT256 if USE_MAX_ALLOWANCE else ALLOWANCE_THRESHOLD
-                        approve_tx = token.functions.approve(market_cs, amount).build_transaction({
-                            "from": addr,
-                            "nonce": nonce,
-                            "gas": GAS_LIMIT_APPROVE,
-                            "gasPrice": gas_price,
-                            "chainId": CHAIN_ID
-                        })
-                        signed = w3.eth.account.sign_transaction(approve_tx, private_key=pk)
-                        tx_hash = send_raw_with_retry(w3, signed.raw_transaction)
-                        print(f"[{addr[:6]}] ✅ APPROVE https://basescan.org/tx/0x{tx_hash.hex()} -> {market_cs} (nonce={nonce})")
-                        # 等待链上确认
-                        try:
-                            receipt = w3.eth.wait_for_transaction_receipt(tx_hash, timeout=5, poll_latency=3)
-                            if receipt.status == 1:
-                                nonce += 1
-                                sent_approve += 1
-                            else:
-                                print(
-                                    f"[{addr[:6]}] ❌ APPROVE failed (status=0): https://basescan.org/tx/0x{tx_hash.hex()}")
-                        except Exception as e:
-                            print(f"[{addr[:6]}] ⚠️ APPROVE error waiting receipt: {e}")
-                    except Exception as e:
-                        print(f"[{addr[:6]}] ❌ 授权失败 {market_cs}: {e}")
-                        time.sleep(0.5)
-
-            # 2) buy 交易
-            if DO_BUY:
+                    sent_buy -= 1
+                    # 本地记录可能已过期（授权被撤销/耗尽），下次运行重新查 allowance
+                    revoke_approved(addr, market_cs, token_cs)
+            elif kind == "APPROVE":
+                record_approved(addr, market_cs, token_cs)
+        pending_txs = still_pending
+
+    def send_pipelined(txs: List[dict]) -> Iterator[Tuple[int, object]]:
+        """
+        发送阶段：按连续 nonce 注入缓存的 gasPrice 后签名，签好一笔推一笔入 mempool（不等回执）。
+        某笔发送失败时不占用其 nonce，其后的交易按新 nonce 重签后继续；
+        nonce 冲突时从 pending 刷新 nonce 重签一次；刷新只会把 nonce 往前推：
+        本地 next_nonce 只在发送成功后才递增，节点给出更小的值说明它还没看到本钱包已发出的交易。
+        逐笔产出 (txs 下标, (tx_hash, nonce) 或该笔的发送异常)。
+        """
+        nonlocal next_nonce
+        done = 0
+        nonce_refreshed = False
+        while done < len(txs):
+            failover()
+            gas_price = read_with_failover(lambda w: get_gas_price_cached(w, gas_state))
+            pending = txs[done:]
+            for k, tx in enumerate(pending):
+                tx["nonce"] = next_nonce + k
+                tx["gasPrice"] = gas_price
+            signed = iter_signed(pending, pk)
+            for tx, raw in zip(pending, signed):
+                failover()
                 try:
-                    gas_price = w3.eth.gas_price
-                    market = w3.eth.contract(address=market_cs, abi=MARKET_ABI)
-
-                    buy_tx_data = market.functions.buy(
-                        buy_amount_smallest,
-                        buy_outcome_index,
-                        buy_amount_smallest
-                    ).build_transaction({"from": addr})["data"]
-                    # 你也可以用 data 验证：print("input=", data)
-
-                    buy_tx = {
-                        "to": market_cs,
-                        "from": addr,
-                        "data": buy_tx_data,
-                        "value": 0,                     # buy 非payable，通常为0
-                        "nonce": nonce,
-                        "gas": GAS_LIMIT_BUY,
-                        "gasPrice": gas_price,
-                        "chainId": CHAIN_ID
-                    }
-                    signed = w3.eth.account.sign_transaction(buy_tx, private_key=pk)
-                    tx_hash = send_raw_with_retry(w3, signed.raw_transaction)
-                    print(f"[{addr[:6]}] 🟩 BUY https://basescan.org/tx/0x{tx_hash.hex()} -> outcome={buy_outcome_index}, invest={buy_amount_smallest} (nonce={nonce})")
-                    nonce += 1
-                    sent_buy += 1
-                    time.sleep(SLEEP_BETWEEN_TX + random.random()*0.4)
+                    tx_hash = send_raw_with_retry(w3, raw, gas_state, proxy_url)
                 except Exception as e:
-                    print(f"[{addr[:6]}] ❌ BUY 失败 {market_cs}: {e}")
-                    time.sleep(0.5)
+                    if is_nonce_error(e) and not nonce_refreshed:
+                        pending_nonce = read_with_failover(
+                            lambda w: w.eth.get_transaction_count(addr, block_identifier="pending"))
+                        next_nonce = max(next_nonce, pending_nonce)
+                        nonce_refreshed = True
+                        logger.warning("[%s] ⚠️ nonce 冲突，刷新为 %s 后重发", addr[:6], next_nonce)
+                    else:
+                        yield done, e
+                        done += 1
+                        nonce_refreshed = False
+                    break                          # 后面的交易 nonce 失效，回到外层重签
+                next_nonce += 1
+                nonce_refreshed = False
+                yield done, (Web3.to_hex(tx_hash), tx["nonce"])
+                done += 1
+            signed.close()
+
+    # 规划阶段：先把整个钱包要发的交易按顺序排好（余额在此本地扣减），nonce/gasPrice 留到签名时注入
+    plan: List[Tuple[str, str, dict]] = []    # (kind, market, tx)，按 nonce 顺序
+    for market_cs in all_markets:
+        if token_balance < buy_amount_smallest:
+            logger.warning("[%s] ⚠️ 余额不足，当前余额 %s，购买需要 %s", addr[:6],
+                           token_balance // _DECIMALS_MULT, buy_amount_smallest // _DECIMALS_MULT)
+            break                           # 余额不会在循环内增加，后续 market 无需再试
+
+        # 1) 授权
+        if DO_APPROVE:
+            if market_cs in approved:
+                logger.info("[%s] 跳过授权（本地记录已授权）→ %s", addr[:6], market_cs)
+                skipped_approve += 1
+            elif CHECK_ALLOWANCE and allowance_enough(allowances[market_cs]):
+                logger.info("[%s] 跳过授权（已足够）→ %s", addr[:6], market_cs)
+                skipped_approve += 1
+                record_approved(addr, market_cs, token_cs)
+            else:
+                amount = MAX_UINT256 if USE_MAX_ALLOWANCE else ALLOWANCE_THRESHOLD
+                plan.append(("APPROVE", market_cs, {
+                    "to": token_cs,
+                    "from": addr,
+                    "data": encode_approve_data(market_cs, amount),
+                    "value": 0,
+                    "gas": GAS_LIMIT_APPROVE,
+                    "chainId": CHAIN_ID
+                }))
+
+        # 2) buy 交易
+        if DO_BUY:
+            buy_data = encode_buy_data(buy_amount_smallest, buy_outcome_index, buy_amount_smallest)
+            # 你也可以用 data 验证：print("input=", buy_data)
+            plan.append(("BUY", market_cs, {
+                "to": market_cs,
+                "from": addr,
+                "data": buy_data,
+                "value": 0,                     # buy 非payable，通常为0
+                "gas": GAS_LIMIT_BUY,
+                "chainId": CHAIN_ID
+            }))
+            token_balance -= buy_amount_smallest
+
+    # 签名 + 发送阶段：approve(n)、buy(n+1)… 背靠背推入 mempool，节点按 nonce 顺序执行
+    sent_count = 0
+    try:
+        for idx, res in send_pipelined([tx for _, _, tx in plan]):
+            kind, market_cs, _ = plan[idx]
+            if isinstance(res, Exception):
+                logger.error("[%s] ❌ %s失败 %s: %s", addr[:6], '授权' if kind == 'APPROVE' else 'BUY ', market_cs, res)
+                time.sleep(0.5)
+                continue
+            tx_hash, nonce = res
+            pending_txs.append((tx_hash, kind, nonce, market_cs))
+            sent_count += 1
+            if kind == "APPROVE":
+                logger.info("[%s] ✅ APPROVE https://basescan.org/tx/%s -> %s (nonce=%s)", addr[:6], tx_hash, market_cs, nonce)
+                sent_approve += 1
+            else:
+                logger.info("[%s] 🟩 BUY https://basescan.org/tx/%s -> outcome=%s, invest=%s (nonce=%s)", addr[:6], tx_hash, buy_outcome_index, buy_amount_smallest, nonce)
+                sent_buy += 1
+                time.sleep(SLEEP_BETWEEN_TX + random.random()*0.4)
+
+            # 每发出 K 笔非阻塞地查一次回执（只发一次 batch，不等待）
+            if sent_count % RECEIPT_CHECK_EVERY == 0:
+                reconcile(0)
+    except Exception as e:
+        logger.error("[%s] ❌ 发送中断: %s", addr[:6], e)
+
+    # 结束时对剩余交易统一轮询，超时仍未确认的只提示
+    if pending_txs:
+        reconcile(RECEIPT_TIMEOUT)
+    for tx_hash, kind, nonce, _ in pending_txs:
+        logger.warning("[%s] ⚠️ %s 未在 %ss 内确认 (nonce=%s): https://basescan.org/tx/%s", addr[:6], kind, RECEIPT_TIMEOUT, nonce, tx_hash)
 
-    print(f"[{addr[:6]}] 完成：approve={sent_approve}, buy={sent_buy}, skipped_approve={skipped_approve}")
+    logger.info("[%s] 完成：approve=%s, buy=%s, skipped_approve=%s", addr[:6], sent_approve, sent_buy, skipped_approve)
     return addr, sent_approve, sent_buy, skipped_approve
 
 # ====== 主流程 ======
@@ -294,25 +813,19 @@ def main():
     }
     priv_keys = load_private_keys(PRIVATE_KEYS_FILE)
     proxies = load_proxies(PROXIES_FILE)
+    APPROVED.update(load_approved(APPROVED_FILE, TOKEN_ADDRESS))
 
     items = list(price_map.items())
     print("\n🔍 正在获取市场地址 …")
     # ====== 并发获取市场地址 ======
-    with ThreadPoolExecutor(max_workers=10) as executor:  # 可根据网络调整
-        futures = {executor.submit(fetch_markets_for_oracle, oid): (sym, oid) for sym, oid in items}
-
-        for future in as_completed(futures):
-            sym, oid = futures[future]
-            try:
-                future.result()
-            except Exception as e:
-                pass
-
+    for (sym, oid), addr in zip(items, asyncio.run(fetch_all(items))):
+        if isinstance(addr, str):
+            ALL_MARKET[oid] = addr
 
     # 选择币种
     print("📜 可选币种：")
     for i, (sym, oid) in enumerate(items, 1):
-        print(f"{i}. {sym} (priceOracleId={oid} priceContract={ALL_MARKET[oid]})")
+        print(f"{i}. {sym} (priceOracleId={oid} priceContract={ALL_MARKET.get(oid, '获取失败')})")
     choice = input("\n请输入要操作的币种序号: ").strip()
 
     selected: List[Tuple[str,int]] = []
@@ -376,19 +889,16 @@ def main():
     buy_amount_smallest = to_smallest_unit(hval, TOKEN_DECIMALS)
     print(f"\n→ buy 参数：investmentAmount={buy_amount_smallest} (decimals={TOKEN_DECIMALS}), outcomeIndex={BUY_outcome_index}, minOutcomeTokensToBuy={BUY_min_tokens}")
 
-    # 先用直连 w3 做地址校验
-    w3_global = make_w3_with_proxy(None)
+    # 启动 worker 前只用直连做一次连通性检查
+    w3_check = make_w3_with_proxy(None)
+    if not w3_check.is_connected():
+        print(f"❌ 无法连接 RPC（{w3_check.provider.endpoint_uri}）"); return
 
-    # 拉取 spender 列表
-    oracle_to_spenders: Dict[int, List[str]] = {}
-    all_spenders: List[str] = []
-    print("\n🔍 正在获取市场地址 …")
-    for sym, oid in selected:
-        addrs: List[str] = [Web3.to_checksum_address(ALL_MARKET[oid])]
-        oracle_to_spenders[oid] = addrs
-        all_spenders.extend(addrs)
-        print(f"  {sym}: {len(addrs)} 个地址")
-    uniq_spenders = list(dict.fromkeys(all_spenders))
+    # spender 列表直接取自开头并发获取的 ALL_MARKET，不再重复获取
+    oracle_to_spenders: Dict[int, Tuple[str, ...]] = {
+        oid: (Web3.to_checksum_address(ALL_MARKET[oid]),) for _, oid in selected if oid in ALL_MARKET
+    }
+    uniq_spenders = list(dict.fromkeys(a for addrs in oracle_to_spenders.values() for a in addrs))
     print(f"\n即将操作的合约地址（ {len(uniq_spenders)} 个）：")
     for a in uniq_spenders:
         print("  ➜", a)
@@ -403,7 +913,7 @@ def main():
 
     print(f"\n🚀 并发执行：{len(priv_keys)} 个钱包，max_workers={MAX_WORKERS}，代理源={len(proxies) or '无'}")
     results = []
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+    with log_listener(), sign_pool(len(priv_keys)), ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
         futs = []
         for idx, pk in enumerate(priv_keys, 1):
             futs.append(ex.submit(
@@ -415,7 +925,7 @@ def main():
             try:
                 results.append(f.result())
             except Exception as e:
-                print(f"线程异常：{e}")
+                logger.error("线程异常：%s", e)
 
     total_app = sum(r[1] for r in results)
     total_buy = sum(r[2] for r in results)
@@ -471,13 +981,14 @@ def run_for_markets(
 
     spenders_map = _prepare_oracle_map_from_markets(market_addresses)
     workers = load_private_keys(PRIVATE_KEYS_FILE)
+    APPROVED.update(load_approved(APPROVED_FILE, token_addr))
     if not workers:
         raise RuntimeError("未加载到私钥，请检查 PRIVATE_KEYS_FILE")
 
     use_max_workers = max_workers or MAX_WORKERS
     results = []
     print(f"▶ run_for_markets: markets={len(market_addresses)}, wallets={len(workers)}, workers={use_max_workers}")
-    with ThreadPoolExecutor(max_workers=use_max_workers) as ex:
+    with log_listener(), sign_pool(len(workers)), ThreadPoolExecutor(max_workers=use_max_workers) as ex:
         futs = []
         for idx, pk in enumerate(workers, 1):
             futs.append(ex.submit(
@@ -494,7 +1005,7 @@ def run_for_markets(
             try:
                 results.append(f.result())
             except Exception as e:
-                print(f"线程异常：{e}")
+                logger.error("线程异常：%s", e)
     return results
 
 if __name__ == "__main__":